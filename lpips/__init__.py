@@ -38,6 +38,24 @@ class PerceptualLoss(torch.nn.Module):
 
         return self.model.forward(target, pred)
 
+    def forward_features(self, img, normalize=False):
+        """
+        Computes the normalized network features of img, which can be cached
+        and passed to distance() if the same image is compared repeatedly
+        """
+        if normalize:
+            img = 2 * img - 1
+
+        return self.model.net.forward_features(img)
+
+    def distance(self, pred_feats, target_feats, out_H=None):
+        """
+        Computes the distance between features returned by forward_features
+        out_H is the height of the input images, required if spatial is True
+        Output pytorch Variable N long
+        """
+        return self.model.net.distance(target_feats, pred_feats, out_H=out_H)
+
 
 class EmotionLoss(torch.nn.Module):
     # VGG using our perceptually-learned weights (LPIPS metric)
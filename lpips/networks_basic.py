@@ -65,23 +65,33 @@ class PNetLin(nn.Module):
                 self.lins += [self.lin5, self.lin6]
 
     def forward(self, in0, in1, retPerLayer=False):
-        # v0.0 - original release had a bug, where input was not scaled
-        in0_input, in1_input = (self.scaling_layer(in0), self.scaling_layer(in1)) if self.version == '0.1' else (in0, in1)
-        outs0, outs1 = self.net.forward(in0_input), self.net.forward(in1_input)
-        feats0, feats1, diffs = {}, {}, {}
+        feats0, feats1 = self.forward_features(in0), self.forward_features(in1)
+        return self.distance(feats0, feats1, out_H=in0.shape[2], retPerLayer=retPerLayer)
 
+    def forward_features(self, in0):
+        ''' Normalized features of all layers, can be cached for a fixed input '''
+        # v0.0 - original release had a bug, where input was not scaled
+        in0_input = self.scaling_layer(in0) if self.version == '0.1' else in0
+        outs0 = self.net.forward(in0_input)
+        return [util.normalize_tensor(outs0[kk]) for kk in range(self.L)]
+
+    def distance(self, feats0, feats1, out_H=None, retPerLayer=False):
+        ''' Distance between two lists of features from forward_features,
+        out_H is the input image height and required in spatial mode '''
+        if(self.spatial and out_H is None):
+            raise ValueError('out_H is required for spatial distances')
+        diffs = {}
         for kk in range(self.L):
-            feats0[kk], feats1[kk] = util.normalize_tensor(outs0[kk]), util.normalize_tensor(outs1[kk])
             diffs[kk] = (feats0[kk] - feats1[kk])**2
 
         if(self.lpips):
             if(self.spatial):
-                res = [upsample(self.lins[kk].model(diffs[kk]), out_H=in0.shape[2]) for kk in range(self.L)]
+                res = [upsample(self.lins[kk].model(diffs[kk]), out_H=out_H) for kk in range(self.L)]
             else:
                 res = [spatial_average(self.lins[kk].model(diffs[kk]), keepdim=True) for kk in range(self.L)]
         else:
             if(self.spatial):
-                res = [upsample(diffs[kk].sum(dim=1, keepdim=True), out_H=in0.shape[2]) for kk in range(self.L)]
+                res = [upsample(diffs[kk].sum(dim=1, keepdim=True), out_H=out_H) for kk in range(self.L)]
             else:
                 res = [spatial_average(diffs[kk].sum(dim=1, keepdim=True), keepdim=True) for kk in range(self.L)]
 
@@ -1,5 +1,11 @@
+import inspect
 import torch.nn as nn
 
+from torch.utils.checkpoint import checkpoint
+
+# Prefer the non-reentrant checkpoint implementation where it is available
+_HAS_USE_REENTRANT = 'use_reentrant' in inspect.signature(checkpoint).parameters
+
 
 class AdaIN(nn.Module):
     def __init__(self, latent_size, channels):
@@ -38,3 +44,20 @@ class LinearAdaIN(nn.Module):
         x = x * (style[:, 0] + 1.) + style[:, 1]
 
         return x
+
+
+class Checkpointed(nn.Module):
+    """
+    Wraps a module with gradient checkpointing, its activations are
+    recomputed during backward instead of being stored
+    """
+    def __init__(self, module):
+        super().__init__()
+        self.module = module
+
+    def forward(self, x):
+        if not x.requires_grad:
+            return self.module(x)
+        if _HAS_USE_REENTRANT:
+            return checkpoint(self.module, x, use_reentrant=False)
+        return checkpoint(self.module, x)
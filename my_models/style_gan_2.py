@@ -622,6 +622,7 @@ class Generator(nn.Module):
         truncation_latent=None,
         input_is_latent=False,
         noise=None,
+        max_res=None,
     ):
         if not input_is_latent:
             styles = [self.style(s).view(-1, 1, self.style_dim) for s in styles]
@@ -667,6 +668,10 @@ class Generator(nn.Module):
             out = conv2(out, latent[:, i + 1], noise=noise[noise_i + 1])
             skip = to_rgb(out, latent[:, i + 2], skip)
 
+            # Stop synthesis early at the skip output of resolution max_res
+            if max_res is not None and skip.shape[2] >= max_res:
+                break
+
             i += 2
             noise_i += 2
 
@@ -76,4 +76,6 @@ class FusedLeakyReLU(nn.Module):
 
 
 def fused_leaky_relu(input, bias, negative_slope=0.2, scale=2 ** 0.5):
+    # The kernel expects input and bias of the same dtype (e.g. under autocast)
+    bias = bias.to(input.dtype)
     return FusedLeakyReLUFunction.apply(input, bias, negative_slope, scale)
@@ -135,6 +135,8 @@ class UpFirDn2d(Function):
 
 
 def upfirdn2d(input, kernel, up=1, down=1, pad=(0, 0)):
+    # The kernel expects input and kernel of the same dtype (e.g. under autocast)
+    kernel = kernel.to(input.dtype)
     out = UpFirDn2d.apply(
         input, kernel, (up, up), (down, down), (pad[0], pad[1], pad[0], pad[1])
     )
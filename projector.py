@@ -1,13 +1,19 @@
 import argparse
+import contextlib
 import glob
+import hashlib
+import inspect
 import os
 import numpy as np
 import torch
 import torch.nn.functional as F
 
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 from lpips import PerceptualLoss
 from my_models import style_gan_2
+from my_models.model_utils import Checkpointed
+from my_models.models import resnetEncoder
 from PIL import Image
 from torchvision import transforms
 from torchvision.utils import save_image
@@ -26,6 +32,19 @@ class Projector:
                  noise_ramp_length=0.75,
                  verbose=True,
                  initial_latent=None,
+                 jit=False,
+                 amp=False,
+                 cuda_graph=False,
+                 synthesis_res=None,
+                 n_coarse_latent=None,
+                 coarse_length=0.25,
+                 patience=None,
+                 min_delta=1e-4,
+                 channels_last=False,
+                 checkpoint_lpips=False,
+                 compile_loss=False,
+                 optimizer='adam',
+                 fused_optimizer=False,
                  ):
 
         self.num_steps = num_steps
@@ -38,18 +57,139 @@ class Projector:
         self.lr_rampup_length = lr_rampup_length
         self.noise_ramp_length = noise_ramp_length
         self.regularize_noise_weight = 1e5
+        self.fine_lr_factor = 0.1
+        self.log_every = 50
         self.verbose = verbose
+        self.amp = amp
+        self.cuda_graph = cuda_graph
+        self.synthesis_res = synthesis_res
+        self.n_coarse_latent = n_coarse_latent
+        self.coarse_length = coarse_length
+        self.patience = patience
+        self.min_delta = min_delta
+        self.channels_last = channels_last
+        self.optimizer = optimizer
+        self.fused_optimizer = fused_optimizer
 
         self.latent_expr = None
         self.lpips = None
         self.target_images = None
         self.loss = None
         self.cur_step = None
+        self._graphed_losses = {}
 
         self.g_ema = g
         self.device = next(g.parameters()).device
 
+        # The loss is computed at 256 x 256, synthesis can only stop at a
+        # ToRGB output of at least that resolution
+        if synthesis_res is not None:
+            is_pow2 = synthesis_res > 0 and synthesis_res & (synthesis_res - 1) == 0
+            if not is_pow2 or not 256 <= synthesis_res <= g.size:
+                raise ValueError(
+                    'synthesis_res must be a power of two between 256 and {}, got {}'.format(
+                        g.size, synthesis_res))
+
+        # Both the coarse and the fine param group need at least one layer
+        if n_coarse_latent is not None and not 0 < n_coarse_latent < g.n_latent:
+            raise ValueError(
+                'n_coarse_latent must be between 1 and {}, got {}'.format(
+                    g.n_latent - 1, n_coarse_latent))
+
         # Find latent stats
+        self.find_latent_stats()
+        self._info('std = {}'.format(self.latent_std))
+
+        if initial_latent is None:
+            initial_latent = self.latent_mean.detach().clone().view(1, 1, -1)
+            initial_latent = initial_latent.repeat(1, self.g_ema.n_latent, 1)
+        elif len(initial_latent.shape) == 2:
+            initial_latent = initial_latent.unsqueeze(0)
+
+        # Find noise inputs. All noise maps live in one flat buffer, maps of
+        # the same resolution are a [n, 1, res, res] view into it and
+        # self.noises holds views of the single maps
+        noises = [n.detach() for n in self.g_ema.noises]
+        resolutions = sorted(set(n.shape[-1] for n in noises))
+        self._noise_flat = torch.cat([n.flatten() for res in resolutions
+                                      for n in noises if n.shape[-1] == res])
+        self.noises_by_res = {}
+        offset = 0
+        for res in resolutions:
+            n_res = sum(n.shape[-1] == res for n in noises)
+            self.noises_by_res[res] = self._noise_flat.narrow(
+                0, offset, n_res * res * res).view(n_res, 1, res, res)
+            offset += n_res * res * res
+        self.noises = []
+        n_seen = {res: 0 for res in self.noises_by_res}
+        for noise in noises:
+            res = noise.shape[-1]
+            self.noises.append(
+                self.noises_by_res[res][n_seen[res]:n_seen[res] + 1])
+            n_seen[res] += 1
+
+        # Init latents and optimizer, latent_in has shape [b, n_latent, 512]
+        self.set_latent(initial_latent)
+
+        # Init loss function
+        self.lpips = PerceptualLoss(model='net-lin', net='vgg',
+                                    use_gpu=self.device.type == 'cuda',
+                                    gpu_id=self.device.index or 0)
+        self.lpips.model.net.eval().requires_grad_(False)
+        if any(p.device != self.device for p in self.lpips.model.net.parameters()):
+            raise RuntimeError(
+                'LPIPS network is not on the projector device {}'.format(self.device))
+        if self.channels_last:
+            self.lpips.model.net.to(memory_format=torch.channels_last)
+        if checkpoint_lpips and (jit or cuda_graph or compile_loss):
+            raise ValueError(
+                'checkpoint_lpips can not be combined with jit, cuda_graph or compile_loss')
+        if checkpoint_lpips:
+            self.checkpoint_lpips()
+        if jit:
+            self.jit_lpips()
+
+        # Mixed precision, only the forward pass runs in fp16. latent_in
+        # and the optimizer state stay in fp32
+        if self.amp:
+            self.scaler = torch.cuda.amp.GradScaler()
+
+        # Fuse the loss computation with TorchInductor, custom ops in op/
+        # cause graph breaks but the code in between is still compiled
+        if compile_loss and cuda_graph:
+            raise ValueError('compile_loss and cuda_graph can not be combined')
+        self._compiled_loss = None
+        if compile_loss:
+            self._compiled_loss = torch.compile(
+                self.compute_loss, mode='reduce-overhead', fullgraph=False)
+
+    def _info(self, *args):
+        if self.verbose:
+            print('Projector:', *args)
+
+    def find_latent_stats(self):
+        # Latent stats only depend on the mapping network, cache them on
+        # disk keyed by a hash of its weights
+        md5 = hashlib.md5(str(self.n_mean_latent).encode())
+        for p in self.g_ema.style.parameters():
+            md5.update(p.detach().cpu().numpy().tobytes())
+        repo_dir = os.path.dirname(os.path.abspath(__file__))
+        cache_path = os.path.join(
+            repo_dir, '.latent_stats_{}.pt'.format(md5.hexdigest()))
+
+        if os.path.exists(cache_path):
+            self._info('Loading W midpoint and stddev from %s' % cache_path)
+            stats = torch.load(cache_path, map_location=self.device)
+            self.latent_mean = stats['latent_mean']
+            self.latent_std = stats['latent_std']
+        else:
+            self.sample_latent_stats(cache_path)
+
+        # Reseed after the stats are known, so the latent noise in step()
+        # is the same whether or not the cache was hit
+        torch.manual_seed(123)
+
+    def sample_latent_stats(self, cache_path):
         self._info(
             ('Finding W midpoint and stddev using %d samples...' % self.n_mean_latent))
         torch.manual_seed(123)
@@ -61,28 +201,130 @@ class Projector:
         self.latent_mean = latent_out.mean(0)
         self.latent_std = (
             (latent_out - self.latent_mean).pow(2).sum() / self.n_mean_latent) ** 0.5
-        self._info('std = {}'.format(self.latent_std))
-
-        if initial_latent is None:
-            self.latent_in = self.latent_mean.detach().clone().unsqueeze(0)
-            self.latent_in = self.latent_in.repeat(self.g_ema.n_latent, 1)
+        try:
+            torch.save({'latent_mean': self.latent_mean.cpu(),
+                        'latent_std': self.latent_std.cpu()}, cache_path)
+        except OSError as e:
+            self._info('Not caching latent stats: {}'.format(e))
+
+    @property
+    def latent_in(self):
+        if self.latent_fine is None:
+            return self.latent_coarse
+        return torch.cat([self.latent_coarse, self.latent_fine], dim=1)
+
+    def set_latent(self, latent):
+        # With a coarse-to-fine schedule, coarse and fine layers are
+        # optimized in separate param groups. Without one, latent_coarse
+        # holds all layers and latent_fine is None
+        latent = latent.detach().to(self.device)
+        if self.n_coarse_latent is None:
+            self.latent_coarse = latent.clone().requires_grad_(True)
+            self.latent_fine = None
+            params = [self.latent_coarse]
         else:
-            self.latent_in = initial_latent
-        self.latent_in.requires_grad = True
+            n_coarse = self.n_coarse_latent
+            self.latent_coarse = latent[:, :n_coarse].clone().requires_grad_(True)
+            self.latent_fine = latent[:, n_coarse:].clone().requires_grad_(True)
+            params = [
+                {'params': [self.latent_coarse]},
+                {'params': [self.latent_fine]},
+            ]
 
-        # Find noise inputs.
+        # Buffer for the latent noise, refilled in place every step
+        self._noise_buf = torch.empty_like(latent)
 
-        # Init optimizer
         # self.opt = torch.optim.Adam(
-        #     [self.latent_in] + self.noises, lr=self.initial_lr)
-        self.opt = torch.optim.Adam([self.latent_in], lr=self.initial_lr)
+        #     [self.latent_in] + list(self.noises_by_res.values()), lr=self.initial_lr)
+        self.opt = self.make_optimizer(params)
+
+    def make_optimizer(self, params):
+        if self.optimizer == 'adam':
+            opt_class = torch.optim.Adam
+        elif self.optimizer == 'radam':
+            opt_class = torch.optim.RAdam
+        else:
+            raise ValueError('Unknown optimizer {}'.format(self.optimizer))
+
+        # Optionally use the single kernel (fused) or multi tensor (foreach)
+        # update if this PyTorch version supports it. Results are not
+        # guaranteed to be bit-identical to the default implementation
+        kwargs = {}
+        opt_args = inspect.signature(opt_class).parameters
+        if self.fused_optimizer:
+            if 'fused' in opt_args and self.device.type == 'cuda':
+                kwargs['fused'] = True
+            elif 'foreach' in opt_args:
+                kwargs['foreach'] = True
+
+        return opt_class(params, lr=self.initial_lr, **kwargs)
+
+    def checkpoint_lpips(self):
+        # Only activations of the generated image need to be kept for
+        # backward, recompute them per VGG slice to save memory
+        backbone = self.lpips.model.net.net
+        for i in range(1, backbone.N_slices + 1):
+            name = 'slice{}'.format(i)
+            setattr(backbone, name, Checkpointed(getattr(backbone, name)))
+
+    def jit_lpips(self):
+        # Only the frozen VGG backbone is traced. The generator is left
+        # eager because tracing can not record the custom CUDA ops in op/
+        pnet = self.lpips.model.net
+        device = next(pnet.parameters()).device
+        example = torch.randn(1, 3, 256, 256, device=device)
+        if self.channels_last:
+            example = example.contiguous(memory_format=torch.channels_last)
+        with torch.no_grad():
+            backbone = torch.jit.trace(pnet.net.eval(), example)
+        if hasattr(torch.jit, 'freeze'):
+            backbone = torch.jit.freeze(backbone)
+        pnet.net = backbone
+        self._info('Traced LPIPS backbone')
+
+    def _autocast(self):
+        if not self.amp:
+            return contextlib.nullcontext()
+        if self.cuda_graph:
+            # The autocast weight cache can not be used during graph capture
+            return torch.cuda.amp.autocast(cache_enabled=False)
+        return torch.cuda.amp.autocast()
+
+    def compute_loss(self, latent, target_image, *target_feats):
+        # Generate image, optionally stopping synthesis at synthesis_res
+        img_gen = self.g_ema(
+            [latent], input_is_latent=True, noise=self.noises,
+            max_res=self.synthesis_res)[0]
 
-        # Init loss function
-        self.lpips = PerceptualLoss(model='net-lin', net='vgg').to(self.device)
+        # Downsample to 256 x 256
+        img_gen = utils.downsample_256(img_gen)
+        if self.channels_last:
+            img_gen = img_gen.contiguous(memory_format=torch.channels_last)
 
-    def _info(self, *args):
-        if self.verbose:
-            print('Projector:', *args)
+        # Compute perceptual loss against the cached target features
+        gen_feats = self.lpips.forward_features(img_gen)
+        loss = self.lpips.distance(gen_feats, target_feats).sum()
+
+        # Additional MSE loss
+        if self.mse_strength:
+            loss += F.mse_loss(img_gen, target_image) * self.mse_strength
+
+        return loss
+
+    def graphed_loss(self):
+        # Capture the forward and backward pass of compute_loss once per
+        # input shape, afterwards each call only replays the CUDA graphs
+        key = tuple(self.latent_coarse.shape)
+        if self.latent_fine is not None:
+            key += tuple(self.latent_fine.shape)
+        if key not in self._graphed_losses:
+            self._info('Capturing CUDA graph for latents of shape {}'.format(key))
+            sample_latent = self.latent_in.detach().clone().requires_grad_(True)
+            with self._autocast():
+                self._graphed_losses[key] = torch.cuda.make_graphed_callables(
+                    self.compute_loss,
+                    (sample_latent, self.target_image, *self._target_feats))
+        return self._graphed_losses[key]
 
     def update_lr(self, t):
         lr_ramp = min(1.0, (1.0 - t) / self.lr_rampdown_length)
@@ -91,25 +333,35 @@ class Projector:
         self.lr = self.initial_lr * lr_ramp
         self.opt.param_groups[0]['lr'] = self.lr
 
+        # Coarse-to-fine schedule, fine layers are frozen in the beginning
+        if self.n_coarse_latent is None:
+            return
+        if t < self.coarse_length:
+            self.opt.param_groups[1]['lr'] = 0.
+        else:
+            self.opt.param_groups[1]['lr'] = self.lr * self.fine_lr_factor
+
     def noise_regularization(self):
         reg_loss = 0.0
-        for noise in self.noises:
+        for noise in self.noises_by_res.values():
             size = noise.shape[2]
             while True:
-                reg_loss += (noise * noise.roll(1, dims=3)).mean().pow(2) + \
-                    (noise * noise.roll(1, dims=2)).mean().pow(2)
+                # Horizontal and vertical autocorrelation of all noise maps
+                # of this resolution in one reduction
+                shifted = torch.stack(
+                    [noise.roll(1, dims=3), noise.roll(1, dims=2)])
+                reg_loss += (noise.unsqueeze(0) * shifted).mean(
+                    dim=[2, 3, 4]).pow(2).sum()
                 if size <= 8:
                     break  # Small enough already
-                noise = noise.reshape(
-                    [1, 1, size // 2, 2, size // 2, 2])  # Downscale
-                noise = noise.mean(dim=[3, 5])
+                noise = F.avg_pool2d(noise, 2)  # Downscale
                 size = size // 2
         return reg_loss
 
     def normalize_noise(self):
-        for noise in self.noises:
-            mean = noise.mean()
-            std = noise.std()
+        for noise in self.noises_by_res.values():
+            mean = noise.mean(dim=(1, 2, 3), keepdim=True)
+            std = noise.std(dim=(1, 2, 3), keepdim=True)
             noise.data.add_(-mean).div_(std)
 
     def prepare_input(self, target_image):
@@ -117,20 +369,50 @@ class Projector:
             target_image = target_image.unsqueeze(0)
         if target_image.shape[2] > 256:
             target_image = utils.downsample_256(target_image)
+        if self.channels_last:
+            target_image = target_image.contiguous(memory_format=torch.channels_last)
         self.target_image = target_image
         print(self.target_image.shape)
 
+        # The target is fixed during run(), compute its LPIPS features once
+        with torch.no_grad(), self._autocast():
+            self._target_feats = [
+                f.detach() for f in self.lpips.forward_features(self.target_image)]
+
+        # One latent per target image, warm start from the last projection
+        batch_size = target_image.shape[0]
+        if self.latent_coarse.shape[0] != batch_size:
+            self.set_latent(self.latent_in[-1:].repeat(batch_size, 1, 1))
+
     def run(self, target_images, num_steps):
         self.num_steps = num_steps
         self.prepare_input(target_images)
 
         self._info('Running...')
         pbar = tqdm(range(self.num_steps))
+        best_loss = float('inf')
+        best_step = 0
         for i_step in pbar:
             self.cur_step = i_step
             self.step()
+
+            # Reading the loss syncs with the GPU, only do it every log_every steps
+            if i_step % self.log_every != 0 and i_step != self.num_steps - 1:
+                continue
+            loss = self.loss.item()
             pbar.set_description(
-                (f'loss: {self.loss.item():.4f}; lr: {self.lr:.4f}'))
+                (f'loss: {loss:.4f}; lr: {self.lr:.4f}'))
+
+            # Early stopping once the loss plateaus
+            if self.patience is None:
+                continue
+            if loss < best_loss - self.min_delta:
+                best_loss = loss
+                best_step = i_step
+            elif i_step - best_step >= self.patience:
+                self._info('Loss did not improve for {} steps, stopping at step {}'.format(
+                    i_step - best_step, i_step))
+                break
 
     def step(self):
         # Hyperparameters
@@ -139,26 +421,22 @@ class Projector:
         # Add noise to dlatents
         noise_strength = self.latent_std * self.initial_noise_factor * \
             max(0.0, 1.0 - t / self.noise_ramp_length) ** 2
-        latent_noise = (torch.randn_like(self.latent_in)
-                        * noise_strength).to(self.device)
-        self.latent_expr = self.latent_in + latent_noise
+        self._noise_buf.normal_().mul_(noise_strength)
+        self.latent_expr = self.latent_in + self._noise_buf
 
         # Update learning rate
         self.update_lr(t)
 
         # Train
-        self.img_gen = self.g_ema(
-            [self.latent_expr.unsqueeze(0)], input_is_latent=True, noise=self.g_ema.noises)[0]
-
-        # Downsample to 256 x 256
-        self.img_gen = utils.downsample_256(self.img_gen)
-
-        # Compute perceptual loss
-        self.loss = self.lpips(self.img_gen, self.target_image).sum()
-
-        # Additional MSE loss
-        if self.mse_strength:
-            self.loss += F.mse_loss(self.img_gen, self.target_image) * self.mse_strength
+        if self.cuda_graph:
+            compute_loss = self.graphed_loss()
+        elif self._compiled_loss is not None:
+            compute_loss = self._compiled_loss
+        else:
+            compute_loss = self.compute_loss
+        with self._autocast():
+            self.loss = compute_loss(
+                self.latent_expr, self.target_image, *self._target_feats)
 
         # Noise regularization
         # reg_loss = self.noise_regularization()
@@ -166,15 +444,20 @@ class Projector:
 
         # Update params
         self.opt.zero_grad()
-        self.loss.backward()
-        self.opt.step()
+        if self.amp:
+            self.scaler.scale(self.loss).backward()
+            self.scaler.step(self.opt)
+            self.scaler.update()
+        else:
+            self.loss.backward()
+            self.opt.step()
 
         # Normalize noise
         # self.normalize_noise()
 
     def get_images(self):
         imgs, _ = self.g_ema(
-            [self.latent_in.unsqueeze(0)], input_is_latent=True, noise=self.g_ema.noises)
+            [self.latent_in], input_is_latent=True, noise=self.noises)
         return imgs
 
     def get_latents(self):
@@ -188,17 +471,55 @@ if __name__ == "__main__":
     parser.add_argument('--input', type=str, required=True)
     parser.add_argument('--output_dir', type=str, required=True)
     parser.add_argument('--gpu', type=int, required=True)
+    parser.add_argument('--batch_size', type=int, default=1)
+    parser.add_argument('--jit', action='store_true')
+    parser.add_argument('--amp', action='store_true')
+    parser.add_argument('--cuda_graph', action='store_true')
+    parser.add_argument('--synthesis_res', type=int, default=None)
+    parser.add_argument('--n_coarse_latent', type=int, default=None)
+    parser.add_argument('--patience', type=int, default=None)
+    parser.add_argument('--channels_last', action='store_true')
+    parser.add_argument('--checkpoint_lpips', action='store_true')
+    parser.add_argument('--compile', action='store_true')
+    parser.add_argument('--optimizer', type=str, default='adam',
+                        choices=['adam', 'radam'])
+    parser.add_argument('--fused_optimizer', action='store_true')
+    parser.add_argument('--encoder_ckpt', type=str, default=None)
+    parser.add_argument('--encoder_steps', type=int, default=500)
     args = parser.parse_args()
 
     # Select device
     device = f'cuda:{args.gpu}'
+    torch.backends.cudnn.benchmark = True
 
     # Load model
     g = style_gan_2.PretrainedGenerator1024().to(device).train()
     for param in g.parameters():
         param.requires_grad = False
 
-    proj = Projector(g)
+    proj = Projector(g,
+                     jit=args.jit,
+                     amp=args.amp,
+                     cuda_graph=args.cuda_graph,
+                     synthesis_res=args.synthesis_res,
+                     n_coarse_latent=args.n_coarse_latent,
+                     patience=args.patience,
+                     channels_last=args.channels_last,
+                     checkpoint_lpips=args.checkpoint_lpips,
+                     compile_loss=args.compile,
+                     optimizer=args.optimizer,
+                     fused_optimizer=args.fused_optimizer)
+
+    # Load encoder to initialize the first projection
+    e = None
+    if args.encoder_ckpt is not None:
+        e = resnetEncoder(net=18).eval().to(device)
+        checkpoint = torch.load(args.encoder_ckpt, map_location=device)
+        if type(checkpoint) == dict:
+            e.load_state_dict(checkpoint['model'])
+        else:
+            e.load_state_dict(checkpoint)
+        latent_avg = g.latent_avg.view(1, 1, -1)
 
     # Load target image
     path = args.input
@@ -215,31 +536,68 @@ if __name__ == "__main__":
     if save_dir[-1] != '/':
         save_dir = save_dir + '/'
 
-    # Project images
-    for i, file in tqdm(enumerate(sorted(image_files))):
-        print('Projecting {}'.format(file))
-
-        # Load image
-        target_image = Image.open(file).convert('RGB')
-        transform = transforms.Compose([
-            transforms.ToTensor(),
-            transforms.Normalize([0.5, 0.5, 0.5], [0.5, 0.5, 0.5])
-        ])
-        target_image = transform(target_image).to(device)
-
-        # Run projector
-        proj.run(target_image, 2000 if i == 0 else 100)
+    # Project images in batches
+    transform = transforms.Compose([
+        transforms.ToTensor(),
+        transforms.Normalize([0.5, 0.5, 0.5], [0.5, 0.5, 0.5])
+    ])
+    image_files = sorted(image_files)
+    batches = [image_files[i:i + args.batch_size]
+               for i in range(0, len(image_files), args.batch_size)]
+
+    def load_batch(files):
+        images = [transform(Image.open(file).convert('RGB')) for file in files]
+        return torch.stack(images).pin_memory()
+
+    # Decode the next batch on a worker thread while the current one is
+    # projected, host to device copies go through a separate stream
+    loader = ThreadPoolExecutor(max_workers=1)
+    io_pool = ThreadPoolExecutor(max_workers=2)
+    saves = []
+    copy_stream = torch.cuda.Stream(device=device)
+    next_batch = loader.submit(load_batch, batches[0]) if batches else None
+    for i, files in tqdm(enumerate(batches)):
+        print('Projecting {}'.format(', '.join(files)))
+
+        # Load images
+        target_image = next_batch.result()
+        if i + 1 < len(batches):
+            next_batch = loader.submit(load_batch, batches[i + 1])
+        with torch.cuda.stream(copy_stream):
+            target_image = target_image.to(device, non_blocking=True)
+        torch.cuda.current_stream(device).wait_stream(copy_stream)
+        target_image.record_stream(torch.cuda.current_stream(device))
+
+        # Run projector, the first batch starts from the mean latent or the
+        # encoder prediction, later ones from the previous projection
+        if i == 0 and e is not None:
+            with torch.no_grad():
+                latent_offset = e(utils.downsample_256(target_image))
+            proj.set_latent(latent_offset + latent_avg)
+            proj.run(target_image, args.encoder_steps)
+        else:
+            proj.run(target_image, 2000 if i == 0 else 100)
 
         # Collect results
         generated = proj.get_images()
         latents = proj.get_latents()
         print(latents.shape)
 
-        # Save results
-        save_str = save_dir + file.split('/')[-1].split('.')[0]
+        # Save results on background threads. Each item is cloned into its
+        # own cpu storage, torch.save would otherwise write the whole batch
         os.makedirs(save_dir, exist_ok=True)
-        print('Saving {}'.format(save_str + '_p.png'))
-        if bool_save_image:
-            save_image(generated, save_str + '_p.png',
-                       normalize=True, range=(-1, 1))
-        torch.save(latents.detach().cpu(), save_str + '_p.latent.pt')
+        generated = [img.clone() for img in generated.detach().cpu().unbind(0)]
+        latents = [latent.clone() for latent in latents.detach().cpu().unbind(0)]
+        for file, img, latent in zip(files, generated, latents):
+            save_str = save_dir + file.split('/')[-1].split('.')[0]
+            print('Saving {}'.format(save_str + '_p.png'))
+            if bool_save_image:
+                saves.append(io_pool.submit(save_image, img, save_str + '_p.png',
+                                            normalize=True, range=(-1, 1)))
+            saves.append(io_pool.submit(
+                torch.save, latent, save_str + '_p.latent.pt'))
+
+    loader.shutdown()
+    io_pool.shutdown(wait=True)
+    for save in saves:
+        save.result()  # Raise errors from the background threads
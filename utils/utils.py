@@ -7,6 +7,7 @@ import face_alignment
 import numpy as np
 import os
 import torch
+import torch.nn.functional as F
 
 from argparse import Namespace
 from imageio import mimwrite
@@ -57,9 +58,9 @@ class Downsample(object):
 def downsample_256(img):
     b, c, h, w = img.shape
     if h > 256:
+        # Box filter, same as averaging factor x factor blocks
         factor = h // 256
-        img = img.reshape(b, c, h // factor, factor, w // factor, factor)
-        img = img.mean([3, 5])
+        img = F.avg_pool2d(img, factor)
     return img
 
 